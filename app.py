@@ -4,36 +4,255 @@ Browser History Viewer - A comprehensive tool for analyzing browser history data
 Supports Chrome, Firefox, and Safari SQLite databases
 """
 
+import gzip
 import os
 import sqlite3
 import json
-from datetime import datetime, timezone, timedelta
+from collections import OrderedDict
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
+from flask_compress import Compress
+from flask.helpers import get_debug_flag
+from flask_orjson import OrjsonProvider
 from werkzeug.utils import secure_filename
 import tempfile
 import shutil
+import threading
+import uuid
+import orjson
+
+try:
+    # Optional: only needed for the Parquet history export
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)  # Serialize API payloads with orjson instead of the stdlib json module
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+app.config['COMPRESS_MIMETYPES'] = [
+    'text/html', 'text/css', 'application/javascript', 'application/json'
+]  # The index page and static assets as well as the API payloads
+app.config['COMPRESS_LEVEL'] = 5
+app.config['COMPRESS_MIN_SIZE'] = 2048
+Compress(app)
+
+# Chrome visit transition types
+_CHROME_TRANSITIONS = {
+    0: 'Link',
+    1: 'Typed',
+    2: 'Auto Bookmark',
+    3: 'Auto Subframe',
+    4: 'Manual Subframe',
+    5: 'Generated',
+    6: 'Start Page',
+    7: 'Form Submit',
+    8: 'Reload'
+}
+
+# Column names for each API response; every query for that endpoint
+# returns its values in this order
+HISTORY_COLUMNS = ('last_visit_time', 'url', 'title', 'visit_count', 'typed_count', 'is_hidden')
+DOWNLOADS_COLUMNS = ('start_time', 'end_time', 'filename', 'path', 'received_bytes', 'total_bytes',
+                     'source_url', 'referrer_url')
+VISITS_COLUMNS = ('visit_time', 'url', 'title', 'transition', 'referrer_url', 'referrer_title',
+                  'segment_name')
+SEARCH_TERMS_COLUMNS = ('last_visit_time', 'search_url', 'term', 'page_title', 'visit_count')
+
+# Queries for each supported browser schema. Timestamps are formatted with
+# datetime(..., 'unixepoch') || ' UTC' rather than strftime(), which has to
+# parse its format string for every row
+CHROME_HISTORY_SQL = """
+SELECT
+    CASE WHEN last_visit_time = 0 THEN 'Never'
+         ELSE datetime(last_visit_time / 1000000 - 11644473600, 'unixepoch') || ' UTC'
+    END,
+    COALESCE(url, ''),
+    COALESCE(title, ''),
+    COALESCE(visit_count, 0),
+    COALESCE(typed_count, 0),
+    CASE WHEN hidden THEN 'Yes' ELSE 'No' END
+FROM urls
+ORDER BY last_visit_time DESC
+"""
+
+FIREFOX_HISTORY_SQL = """
+SELECT
+    CASE WHEN last_visit_date = 0 THEN 'Never'
+         ELSE datetime(last_visit_date / 1000000, 'unixepoch') || ' UTC'
+    END,
+    COALESCE(url, ''),
+    COALESCE(title, ''),
+    COALESCE(visit_count, 0),
+    COALESCE(typed, 0),
+    CASE WHEN hidden THEN 'Yes' ELSE 'No' END
+FROM moz_places
+WHERE last_visit_date IS NOT NULL
+ORDER BY last_visit_date DESC
+"""
+
+SAFARI_HISTORY_SQL = """
+SELECT
+    CASE WHEN visit_time = 0 THEN 'Never'
+         ELSE datetime(visit_time + 978307200, 'unixepoch') || ' UTC'
+    END,
+    COALESCE(url, ''),
+    COALESCE(domain_expansion, ''),
+    COALESCE(visit_count, 0),
+    0,  -- Safari doesn't track typed_count
+    'No'  -- Safari doesn't track is_hidden
+FROM history_items
+ORDER BY visit_time DESC
+"""
+
+CHROME_DOWNLOADS_SQL = """
+SELECT
+    CASE WHEN start_time = 0 THEN 'Never'
+         ELSE datetime(start_time / 1000000 - 11644473600, 'unixepoch') || ' UTC'
+    END,
+    CASE WHEN end_time = 0 THEN 'Never'
+         ELSE datetime(end_time / 1000000 - 11644473600, 'unixepoch') || ' UTC'
+    END,
+    COALESCE(target_path, ''),
+    COALESCE(received_bytes, 0),
+    COALESCE(total_bytes, 0),
+    COALESCE(tab_url, ''),
+    COALESCE(tab_referrer_url, '')
+FROM downloads
+ORDER BY start_time DESC
+"""
+
+FIREFOX_DOWNLOADS_SQL = """
+SELECT
+    CASE WHEN dateAdded = 0 THEN 'Never'
+         ELSE datetime(dateAdded / 1000000, 'unixepoch') || ' UTC'
+    END,
+    CASE WHEN lastModified = 0 THEN 'Never'
+         ELSE datetime(lastModified / 1000000, 'unixepoch') || ' UTC'
+    END,
+    COALESCE(title, ''),
+    COALESCE(content, ''),
+    0,
+    0,
+    '',
+    ''
+FROM moz_anno_attributes aa
+JOIN moz_annos a ON aa.id = a.anno_attribute_id
+JOIN moz_places p ON a.place_id = p.id
+WHERE aa.name = 'downloads/destinationFileURI'
+ORDER BY dateAdded DESC
+"""
+
+# The visits queries apply LIMIT in a CTE so the referrer self-joins only
+# run for the 1000 rows returned instead of the whole visits table
+CHROME_VISITS_SQL = """
+WITH recent AS (
+    SELECT v.visit_time, v.transition, v.from_visit, u.url, u.title
+    FROM visits v
+    JOIN urls u ON v.url = u.id
+    ORDER BY v.visit_time DESC
+    LIMIT 1000
+)
+SELECT
+    CASE WHEN r.visit_time = 0 THEN 'Never'
+         ELSE datetime(r.visit_time / 1000000 - 11644473600, 'unixepoch') || ' UTC'
+    END,
+    COALESCE(r.url, ''),
+    COALESCE(r.title, ''),
+    r.transition,
+    COALESCE(ref_u.url, '') as referrer_url,
+    COALESCE(ref_u.title, '') as referrer_title,
+    'Chrome History'
+FROM recent r
+LEFT JOIN visits ref_v ON r.from_visit = ref_v.id
+LEFT JOIN urls ref_u ON ref_v.url = ref_u.id
+ORDER BY r.visit_time DESC
+"""
+
+FIREFOX_VISITS_SQL = """
+WITH recent AS (
+    SELECT hv.visit_date, hv.visit_type, hv.from_visit, p.url, p.title
+    FROM moz_historyvisits hv
+    JOIN moz_places p ON hv.place_id = p.id
+    ORDER BY hv.visit_date DESC
+    LIMIT 1000
+)
+SELECT
+    CASE WHEN r.visit_date = 0 THEN 'Never'
+         ELSE datetime(r.visit_date / 1000000, 'unixepoch') || ' UTC'
+    END,
+    COALESCE(r.url, ''),
+    COALESCE(r.title, ''),
+    CASE WHEN r.visit_type THEN 'Type ' || r.visit_type ELSE 'Unknown' END,
+    COALESCE(ref_p.url, '') as referrer_url,
+    COALESCE(ref_p.title, '') as referrer_title,
+    'Firefox History'
+FROM recent r
+LEFT JOIN moz_historyvisits ref_hv ON r.from_visit = ref_hv.id
+LEFT JOIN moz_places ref_p ON ref_hv.place_id = ref_p.id
+ORDER BY r.visit_date DESC
+"""
+
+CHROME_SEARCH_TERMS_SQL = """
+SELECT
+    CASE WHEN kt.last_visit_time = 0 THEN 'Never'
+         ELSE datetime(kt.last_visit_time / 1000000 - 11644473600, 'unixepoch') || ' UTC'
+    END,
+    COALESCE(kt.url, ''),
+    COALESCE(kt.term, ''),
+    COALESCE(u.title, ''),
+    COALESCE(u.visit_count, 0)
+FROM keyword_search_terms kt
+JOIN urls u ON kt.url_id = u.id
+ORDER BY kt.last_visit_time DESC
+"""
 
 class BrowserHistoryParser:
-    def __init__(self, db_path):
+    def __init__(self, db_path, compress_level=None, compress_min_size=0):
         self.db_path = db_path
+        # One connection per upload, shared by every API call; Flask serves
+        # requests from several threads, so access is serialized by the lock
+        self.lock = threading.Lock()
+        self.conn = self._connect()
         self.browser_type = self.detect_browser_type()
+        # The uploaded database never changes, so every API response is
+        # serialized once here and served from memory afterwards
+        self.payloads = self._build_payloads(compress_level, compress_min_size)
+    
+    def __del__(self):
+        self.close()
+    
+    def close(self):
+        """Close the database connection"""
+        conn = getattr(self, 'conn', None)
+        if conn is not None:
+            # Wait for any query still running on the connection
+            with self.lock:
+                conn.close()
+                self.conn = None
+    
+    def _connect(self):
+        """Open the uploaded database read-only with read-tuned PRAGMAs"""
+        # The upload is a private copy nobody else writes to, so SQLite can
+        # skip locking and journal checks entirely
+        uri = Path(self.db_path).resolve().as_uri() + '?mode=ro&immutable=1'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA mmap_size = 268435456")  # 256MB memory-mapped I/O
+        conn.execute("PRAGMA cache_size = -65536")  # 64MB page cache
+        conn.execute("PRAGMA temp_store = MEMORY")  # Keep ORDER BY sort buffers off disk
+        return conn
     
     def detect_browser_type(self):
         """Detect browser type based on database structure"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Get all table names
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = [row[0] for row in cursor.fetchall()]
-            
-            conn.close()
+            with self.lock:
+                cursor = self.conn.cursor()
+                
+                # Get all table names
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+                tables = {row[0] for row in cursor}
             
             # Chrome detection
             if 'urls' in tables and 'visits' in tables and 'downloads' in tables:
@@ -51,332 +270,155 @@ class BrowserHistoryParser:
             print(f"Error detecting browser type: {e}")
             return 'unknown'
     
-    def chrome_to_timestamp(self, chrome_time):
-        """Convert Chrome timestamp to readable format"""
-        if chrome_time == 0:
-            return "Never"
-        # Chrome timestamps are microseconds since Jan 1, 1601 UTC
-        epoch_start = datetime(1601, 1, 1, tzinfo=timezone.utc)
-        chrome_datetime = epoch_start + timedelta(microseconds=chrome_time)
-        return chrome_datetime.strftime('%Y-%m-%d %H:%M:%S UTC')
-    
-    def webkit_to_timestamp(self, webkit_time):
-        """Convert WebKit timestamp to readable format"""
-        if webkit_time == 0:
-            return "Never"
-        # WebKit timestamps are seconds since Jan 1, 2001 UTC
-        epoch_start = datetime(2001, 1, 1, tzinfo=timezone.utc)
-        webkit_datetime = epoch_start + timedelta(seconds=webkit_time)
-        return webkit_datetime.strftime('%Y-%m-%d %H:%M:%S UTC')
+    def _build_payloads(self, compress_level, compress_min_size):
+        """Serialize every API response, plus a gzip copy of those worth compressing"""
+        payloads = {}
+        for name, columns, rows in (
+            ('history', HISTORY_COLUMNS, self.get_history_data()),
+            ('downloads', DOWNLOADS_COLUMNS, self.get_downloads_data()),
+            ('visits', VISITS_COLUMNS, self.get_visits_data()),
+            ('search_terms', SEARCH_TERMS_COLUMNS, self.get_search_terms_data())
+        ):
+            body = orjson.dumps({'browser_type': self.browser_type, 'columns': columns, 'rows': rows})
+            gzipped = None
+            if compress_level is not None and len(body) >= compress_min_size:
+                gzipped = gzip.compress(body, compresslevel=compress_level)
+            payloads[name] = (body, gzipped)
+        return payloads
     
-    def firefox_to_timestamp(self, firefox_time):
-        """Convert Firefox timestamp to readable format"""
-        if firefox_time == 0:
-            return "Never"
-        # Firefox timestamps are microseconds since Unix epoch
-        firefox_datetime = datetime.fromtimestamp(firefox_time / 1000000, tz=timezone.utc)
-        return firefox_datetime.strftime('%Y-%m-%d %H:%M:%S UTC')
+    def iter_history_rows(self):
+        """Yield history rows, in HISTORY_COLUMNS order, based on browser type"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            
+            if self.browser_type == 'chrome':
+                cursor.execute(CHROME_HISTORY_SQL)
+            elif self.browser_type == 'firefox':
+                cursor.execute(FIREFOX_HISTORY_SQL)
+            elif self.browser_type == 'safari':
+                cursor.execute(SAFARI_HISTORY_SQL)
+            else:
+                return
+            
+            yield from cursor
     
-    def get_history_data(self):
-        """Extract history data based on browser type"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+    def iter_downloads_rows(self):
+        """Yield downloads rows, in DOWNLOADS_COLUMNS order, based on browser type"""
+        with self.lock:
+            cursor = self.conn.cursor()
             
             if self.browser_type == 'chrome':
-                query = """
-                SELECT 
-                    last_visit_time,
-                    url,
-                    title,
-                    visit_count,
-                    typed_count,
-                    hidden
-                FROM urls 
-                ORDER BY last_visit_time DESC
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
-                
-                data = []
-                for row in results:
-                    data.append({
-                        'last_visit_time': self.chrome_to_timestamp(row[0]),
-                        'url': row[1] or '',
-                        'title': row[2] or '',
-                        'visit_count': row[3] or 0,
-                        'typed_count': row[4] or 0,
-                        'is_hidden': 'Yes' if row[5] else 'No'
-                    })
+                cursor.execute(CHROME_DOWNLOADS_SQL)
+                # The query returns target_path once (already '' when NULL, which
+                # basename maps to ''); the filename is derived from it here
+                basename = os.path.basename
+                for row in cursor:
+                    yield (row[0], row[1], basename(row[2]), *row[2:])
                 
             elif self.browser_type == 'firefox':
-                query = """
-                SELECT 
-                    last_visit_date,
-                    url,
-                    title,
-                    visit_count,
-                    typed,
-                    hidden
-                FROM moz_places 
-                WHERE last_visit_date IS NOT NULL
-                ORDER BY last_visit_date DESC
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
-                
-                data = []
-                for row in results:
-                    data.append({
-                        'last_visit_time': self.firefox_to_timestamp(row[0]),
-                        'url': row[1] or '',
-                        'title': row[2] or '',
-                        'visit_count': row[3] or 0,
-                        'typed_count': row[4] or 0,
-                        'is_hidden': 'Yes' if row[5] else 'No'
-                    })
+                cursor.execute(FIREFOX_DOWNLOADS_SQL)
+                yield from cursor
             
-            elif self.browser_type == 'safari':
-                query = """
-                SELECT 
-                    visit_time,
-                    url,
-                    domain_expansion,
-                    visit_count
-                FROM history_items 
-                ORDER BY visit_time DESC
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
+            # Safari and unknown have no downloads
+    
+    def iter_visits_rows(self):
+        """Yield visits rows, in VISITS_COLUMNS order, based on browser type"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            
+            if self.browser_type == 'chrome':
+                cursor.execute(CHROME_VISITS_SQL)
+                for row in cursor:
+                    yield (*row[:3], _CHROME_TRANSITIONS.get(row[3], 'Unknown'), *row[4:])
                 
-                data = []
-                for row in results:
-                    data.append({
-                        'last_visit_time': self.webkit_to_timestamp(row[0]),
-                        'url': row[1] or '',
-                        'title': row[2] or '',
-                        'visit_count': row[3] or 0,
-                        'typed_count': 0,  # Safari doesn't track this
-                        'is_hidden': 'No'  # Safari doesn't track this
-                    })
+            elif self.browser_type == 'firefox':
+                cursor.execute(FIREFOX_VISITS_SQL)
+                yield from cursor
             
-            conn.close()
-            return data
+            # Safari and unknown have no visits
+    
+    def iter_search_terms_rows(self):
+        """Yield search terms rows, in SEARCH_TERMS_COLUMNS order, based on browser type"""
+        with self.lock:
+            cursor = self.conn.cursor()
             
+            if self.browser_type == 'chrome':
+                cursor.execute(CHROME_SEARCH_TERMS_SQL)
+                yield from cursor
+            
+            # Firefox, Safari and unknown don't have easy search terms extraction
+    
+    def get_history_data(self):
+        """Extract history rows, in HISTORY_COLUMNS order, based on browser type"""
+        try:
+            return list(self.iter_history_rows())
         except Exception as e:
             print(f"Error extracting history data: {e}")
             return []
     
     def get_downloads_data(self):
-        """Extract downloads data based on browser type"""
+        """Extract downloads rows, in DOWNLOADS_COLUMNS order, based on browser type"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            if self.browser_type == 'chrome':
-                query = """
-                SELECT 
-                    start_time,
-                    end_time,
-                    target_path,
-                    received_bytes,
-                    total_bytes,
-                    tab_url,
-                    tab_referrer_url
-                FROM downloads 
-                ORDER BY start_time DESC
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
-                
-                data = []
-                for row in results:
-                    path = row[2] or ''
-                    filename = os.path.basename(path) if path else ''
-                    
-                    data.append({
-                        'start_time': self.chrome_to_timestamp(row[0]),
-                        'end_time': self.chrome_to_timestamp(row[1]),
-                        'filename': filename,
-                        'path': path,
-                        'received_bytes': row[3] or 0,
-                        'total_bytes': row[4] or 0,
-                        'source_url': row[5] or '',
-                        'referrer_url': row[6] or ''
-                    })
-                
-            elif self.browser_type == 'firefox':
-                query = """
-                SELECT 
-                    dateAdded,
-                    lastModified,
-                    title,
-                    content
-                FROM moz_anno_attributes aa
-                JOIN moz_annos a ON aa.id = a.anno_attribute_id
-                JOIN moz_places p ON a.place_id = p.id
-                WHERE aa.name = 'downloads/destinationFileURI'
-                ORDER BY dateAdded DESC
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
-                
-                data = []
-                for row in results:
-                    data.append({
-                        'start_time': self.firefox_to_timestamp(row[0]),
-                        'end_time': self.firefox_to_timestamp(row[1]),
-                        'filename': row[2] or '',
-                        'path': row[3] or '',
-                        'received_bytes': 0,
-                        'total_bytes': 0,
-                        'source_url': '',
-                        'referrer_url': ''
-                    })
-            
-            else:  # Safari and unknown
-                data = []
-            
-            conn.close()
-            return data
-            
+            return list(self.iter_downloads_rows())
         except Exception as e:
             print(f"Error extracting downloads data: {e}")
             return []
     
     def get_visits_data(self):
-        """Extract visits data based on browser type"""
+        """Extract visits rows, in VISITS_COLUMNS order, based on browser type"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            if self.browser_type == 'chrome':
-                query = """
-                SELECT 
-                    v.visit_time,
-                    u.url,
-                    u.title,
-                    v.transition,
-                    ref_u.url as referrer_url,
-                    ref_u.title as referrer_title
-                FROM visits v
-                JOIN urls u ON v.url = u.id
-                LEFT JOIN visits ref_v ON v.from_visit = ref_v.id
-                LEFT JOIN urls ref_u ON ref_v.url = ref_u.id
-                ORDER BY v.visit_time DESC
-                LIMIT 1000
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
-                
-                data = []
-                transition_types = {
-                    0: 'Link',
-                    1: 'Typed',
-                    2: 'Auto Bookmark',
-                    3: 'Auto Subframe',
-                    4: 'Manual Subframe',
-                    5: 'Generated',
-                    6: 'Start Page',
-                    7: 'Form Submit',
-                    8: 'Reload'
-                }
-                
-                for row in results:
-                    data.append({
-                        'visit_time': self.chrome_to_timestamp(row[0]),
-                        'url': row[1] or '',
-                        'title': row[2] or '',
-                        'transition': transition_types.get(row[3], 'Unknown'),
-                        'referrer_url': row[4] or '',
-                        'referrer_title': row[5] or '',
-                        'segment_name': 'Chrome History'
-                    })
-                
-            elif self.browser_type == 'firefox':
-                query = """
-                SELECT 
-                    hv.visit_date,
-                    p.url,
-                    p.title,
-                    hv.visit_type,
-                    ref_p.url as referrer_url,
-                    ref_p.title as referrer_title
-                FROM moz_historyvisits hv
-                JOIN moz_places p ON hv.place_id = p.id
-                LEFT JOIN moz_historyvisits ref_hv ON hv.from_visit = ref_hv.id
-                LEFT JOIN moz_places ref_p ON ref_hv.place_id = ref_p.id
-                ORDER BY hv.visit_date DESC
-                LIMIT 1000
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
-                
-                data = []
-                for row in results:
-                    data.append({
-                        'visit_time': self.firefox_to_timestamp(row[0]),
-                        'url': row[1] or '',
-                        'title': row[2] or '',
-                        'transition': f'Type {row[3]}' if row[3] else 'Unknown',
-                        'referrer_url': row[4] or '',
-                        'referrer_title': row[5] or '',
-                        'segment_name': 'Firefox History'
-                    })
-            
-            else:  # Safari and unknown
-                data = []
-            
-            conn.close()
-            return data
-            
+            return list(self.iter_visits_rows())
         except Exception as e:
             print(f"Error extracting visits data: {e}")
             return []
     
     def get_search_terms_data(self):
-        """Extract search terms data based on browser type"""
+        """Extract search terms rows, in SEARCH_TERMS_COLUMNS order, based on browser type"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            if self.browser_type == 'chrome':
-                query = """
-                SELECT 
-                    kt.last_visit_time,
-                    kt.url,
-                    kt.term,
-                    u.title,
-                    u.visit_count
-                FROM keyword_search_terms kt
-                JOIN urls u ON kt.url_id = u.id
-                ORDER BY kt.last_visit_time DESC
-                """
-                cursor.execute(query)
-                results = cursor.fetchall()
-                
-                data = []
-                for row in results:
-                    data.append({
-                        'last_visit_time': self.chrome_to_timestamp(row[0]),
-                        'search_url': row[1] or '',
-                        'term': row[2] or '',
-                        'page_title': row[3] or '',
-                        'visit_count': row[4] or 0
-                    })
-                
-            else:  # Firefox, Safari and unknown don't have easy search terms extraction
-                data = []
-            
-            conn.close()
-            return data
-            
+            return list(self.iter_search_terms_rows())
         except Exception as e:
             print(f"Error extracting search terms data: {e}")
             return []
 
-# Global variable to store current parser
-current_parser = None
+# Parsers for each browser session, keyed by the id in the PARSER_COOKIE cookie.
+# Least recently used first; beyond MAX_PARSERS the oldest session is dropped
+PARSER_COOKIE = 'parser_id'
+MAX_PARSERS = 8
+parsers = OrderedDict()
+parsers_lock = threading.Lock()
+
+def get_parser():
+    """Return the parser for the requesting browser session, if it uploaded a database"""
+    parser_id = request.cookies.get(PARSER_COOKIE)
+    with parsers_lock:
+        parser = parsers.get(parser_id)
+        if parser:
+            parsers.move_to_end(parser_id)
+        return parser
+
+def remove_upload(filepath):
+    """Delete an uploaded database copy"""
+    try:
+        os.remove(filepath)
+    except OSError as e:
+        print(f"Error removing upload {filepath}: {e}")
+
+def discard_parser(parser):
+    """Close a parser that is no longer registered and delete its upload"""
+    parser.close()
+    remove_upload(parser.db_path)
+
+def payload_response(parser, name):
+    """Serve a cached API payload, pre-compressed when the client accepts gzip"""
+    body, gzipped = parser.payloads[name]
+    if gzipped is not None and request.accept_encodings['gzip']:
+        # Flask-Compress leaves responses that already carry a Content-Encoding alone
+        response = Response(gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/')
 def index():
@@ -384,8 +426,6 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    global current_parser
-    
     if 'file' not in request.files:
         return jsonify({'error': 'No file selected'}), 400
     
@@ -395,19 +435,50 @@ def upload_file():
     
     if file and file.filename.lower().endswith('.sqlite'):
         try:
+            # Only reuse ids this process issued
+            parser_id = request.cookies.get(PARSER_COOKIE)
+            with parsers_lock:
+                if parser_id not in parsers:
+                    parser_id = uuid.uuid4().hex
+            
+            # Every upload gets its own file: an earlier parser may still have
+            # its file memory-mapped, so it must never be overwritten in place
             filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+            fd, filepath = tempfile.mkstemp(suffix=f'_{filename}', dir=app.config['UPLOAD_FOLDER'])
+            os.close(fd)
+            
+            try:
+                # Large buffer: uploads are up to 100MB and are copied once before parsing
+                file.save(filepath, buffer_size=1024 * 1024)
+                
+                # Create parser instance
+                parser = BrowserHistoryParser(
+                    filepath,
+                    compress_level=app.config['COMPRESS_LEVEL'],
+                    compress_min_size=app.config['COMPRESS_MIN_SIZE']
+                )
+            except Exception:
+                remove_upload(filepath)
+                raise
             
-            # Create parser instance
-            current_parser = BrowserHistoryParser(filepath)
+            # Register the new parser only once it has loaded, then retire the
+            # session's previous parser and any sessions over the limit
+            with parsers_lock:
+                retired = [parsers.pop(parser_id)] if parser_id in parsers else []
+                parsers[parser_id] = parser
+                while len(parsers) > MAX_PARSERS:
+                    retired.append(parsers.popitem(last=False)[1])
+            for old_parser in retired:
+                discard_parser(old_parser)
             
-            return jsonify({
+            response = jsonify({
                 'success': True,
                 'filename': filename,
-                'browser_type': current_parser.browser_type,
-                'message': f'Successfully loaded {current_parser.browser_type.title()} database'
+                'browser_type': parser.browser_type,
+                'message': f'Successfully loaded {parser.browser_type.title()} database'
             })
+            response.set_cookie(PARSER_COOKIE, parser_id, httponly=True, samesite='Lax')
+            return response
             
         except Exception as e:
             return jsonify({'error': f'Error processing file: {str(e)}'}), 500
@@ -416,55 +487,83 @@ def upload_file():
 
 @app.route('/api/history')
 def get_history():
-    global current_parser
-    if not current_parser:
+    parser = get_parser()
+    if not parser:
         return jsonify({'error': 'No database loaded'}), 400
     
-    try:
-        data = current_parser.get_history_data()
-        return jsonify({'data': data, 'browser_type': current_parser.browser_type})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return payload_response(parser, 'history')
 
 @app.route('/api/downloads')
 def get_downloads():
-    global current_parser
-    if not current_parser:
+    parser = get_parser()
+    if not parser:
         return jsonify({'error': 'No database loaded'}), 400
     
-    try:
-        data = current_parser.get_downloads_data()
-        return jsonify({'data': data, 'browser_type': current_parser.browser_type})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return payload_response(parser, 'downloads')
 
 @app.route('/api/visits')
 def get_visits():
-    global current_parser
-    if not current_parser:
+    parser = get_parser()
+    if not parser:
         return jsonify({'error': 'No database loaded'}), 400
     
-    try:
-        data = current_parser.get_visits_data()
-        return jsonify({'data': data, 'browser_type': current_parser.browser_type})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return payload_response(parser, 'visits')
 
 @app.route('/api/search-terms')
 def get_search_terms():
-    global current_parser
-    if not current_parser:
+    parser = get_parser()
+    if not parser:
         return jsonify({'error': 'No database loaded'}), 400
     
+    return payload_response(parser, 'search_terms')
+
+@app.route('/api/history.parquet')
+def get_history_parquet():
+    parser = get_parser()
+    if not parser:
+        return jsonify({'error': 'No database loaded'}), 400
+    if pq is None:
+        return jsonify({'error': 'Parquet export requires pyarrow to be installed'}), 501
+    
     try:
-        data = current_parser.get_search_terms_data()
-        return jsonify({'data': data, 'browser_type': current_parser.browser_type})
+        # The count columns are integers; every other history column is text
+        schema = pa.schema([
+            (name, pa.int64() if name in ('visit_count', 'typed_count') else pa.string())
+            for name in HISTORY_COLUMNS
+        ])
+        # iter_history_rows() lets query errors reach the except below as a 500
+        rows = list(parser.iter_history_rows())
+        # Transpose once so each column becomes a single Arrow array
+        columns = list(zip(*rows)) or [()] * len(schema)
+        table = pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        )
+        
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+        return Response(
+            sink.getvalue().to_pybytes(),
+            mimetype='application/vnd.apache.parquet',
+            headers={'Content-Disposition': 'attachment; filename=history.parquet'}
+        )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def run_server():
+    """Serve the app with waitress, or the Flask dev server when FLASK_DEBUG=1"""
+    if get_debug_flag():
+        # Reloader and debugger, for development only
+        app.run(debug=True, host='0.0.0.0', port=5000)
+    else:
+        from waitress import serve
+        
+        # Threads rather than processes: uploaded parsers live in this process
+        serve(app, host='0.0.0.0', port=5000, threads=8)
+
 if __name__ == '__main__':
     # Create templates directory if it doesn't exist
     os.makedirs('templates', exist_ok=True)
     os.makedirs('static', exist_ok=True)
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    run_server()
\ No newline at end of file
@@ -34,10 +34,13 @@ def check_requirements():
     try:
         import flask
         import werkzeug
+        import flask_orjson
+        import flask_compress
+        import waitress
         return True
     except ImportError as e:
         print(f"❌ Missing required package: {e}")
-        print("Please install requirements with: pip install Flask Werkzeug")
+        print("Please install requirements with: pip install -r requirements.txt")
         return False
 
 def main():
@@ -54,14 +57,14 @@ def main():
     
     # Import and run the main application
     try:
-        from app import app
+        from app import run_server
         print("✅ Application loaded successfully!")
         print("🚀 Starting server...")
         print("📂 Upload your browser database files at: http://localhost:5000")
         print("⏹️  Press Ctrl+C to stop the server")
         print("-" * 50)
         
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        run_server()
         
     except ImportError:
         print("❌ Could not import app.py")